@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Icelect - Benchmarks of computing results
+# (c) 2025 Martin Mareš <mj@ucw.cz>
+
+# Run from the top-level directory as:
+#
+#   python3 -m bench.bench_results [options] > bench_output.txt
+#
+# Results are written as JSON lines, one per benchmark case. Two such
+# outputs (e.g., from different commits) can be compared using:
+#
+#   python3 -m bench.bench_results --compare OLD NEW
+
+import argparse
+import json
+import numpy as np
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable
+
+from icelect.results import Results
+
+
+def gen_impartial(rng: np.random.Generator, num_ballots: int, num_options: int) -> np.ndarray:
+    """
+    Impartial culture: every ballot is a uniformly random strict order.
+    """
+
+    return np.argsort(rng.random((num_ballots, num_options)), axis=1).astype(np.int16) + 1
+
+
+def gen_mallows(rng: np.random.Generator, num_ballots: int, num_options: int, phi: float = 0.7) -> np.ndarray:
+    """
+    Mallows model with dispersion phi around the order 0, 1, ..., n-1,
+    sampled by the repeated insertion method for all ballots at once.
+    """
+
+    pos = np.zeros((num_ballots, num_options), dtype=np.int16)
+    for i in range(1, num_options):
+        # Insert option i at slot i-d, where P[d] is proportional to phi^d for d=0..i
+        u = rng.random(num_ballots)
+        d = np.floor(np.log1p(-u * (1 - phi ** (i + 1))) / np.log(phi)).astype(np.int16)
+        slot = i - np.minimum(d, i)
+        pos[:, :i] += pos[:, :i] >= slot[:, None]
+        pos[:, i] = slot
+    return pos + 1
+
+
+def gen_heavy_ties(rng: np.random.Generator, num_ballots: int, num_options: int) -> np.ndarray:
+    """
+    Ballots with many ties: the voter ranks only a few options and leaves
+    the rest at the default value of the voting form, which is the last rank.
+    """
+
+    ranks = np.full((num_ballots, num_options), num_options, dtype=np.int16)
+    num_ranked = rng.integers(1, min(3, num_options - 1), endpoint=True, size=num_ballots)
+    order = np.argsort(rng.random((num_ballots, num_options)), axis=1)
+    for k in range(num_ranked.max()):
+        rows = np.nonzero(num_ranked > k)[0]
+        ranks[rows, order[rows, k]] = k + 1
+    return ranks
+
+
+GENERATORS: dict[str, Callable[[np.random.Generator, int, int], np.ndarray]] = {
+    'impartial': gen_impartial,
+    'mallows': gen_mallows,
+    'ties': gen_heavy_ties,
+}
+
+
+def run_case(args: argparse.Namespace, generator: str, num_options: int, num_ballots: int) -> dict[str, Any]:
+    rng = np.random.default_rng(args.seed)
+    ranks = GENERATORS[generator](rng, num_ballots, num_options)
+
+    best: dict[str, float] = {}
+    for _ in range(args.repeat):
+        res = Results(num_options, ranks, strength_engine=args.engine)
+        start = time.perf_counter()
+        res.to_json()
+        times = dict(res.timings, to_json=time.perf_counter() - start)
+        for phase, t in times.items():
+            best[phase] = min(best.get(phase, t), t)
+
+    return {
+        'generator': generator,
+        'options': num_options,
+        'ballots': num_ballots,
+        'engine': args.engine,
+        'times': best,
+        'total': sum(best.values()),
+    }
+
+
+def environment() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+    }
+
+
+def cmd_run(args: argparse.Namespace) -> None:
+    env = environment()
+    for generator in args.generators:
+        for num_options in args.options:
+            for num_ballots in args.ballots:
+                if num_ballots * num_options * num_options > args.max_cells:
+                    continue
+                case = run_case(args, generator, num_options, num_ballots)
+                case.update(env)
+                print(json.dumps(case), flush=True)
+                print(f'{generator:10} {num_options:5} options {num_ballots:8} ballots: {case["total"]:9.4f} s', file=sys.stderr)
+
+
+def cmd_compare(args: argparse.Namespace) -> None:
+    def load(filename: str) -> dict[tuple, dict[str, Any]]:
+        cases = {}
+        with open(filename) as f:
+            for line in f:
+                c = json.loads(line)
+                cases[c['generator'], c['options'], c['ballots'], c['engine']] = c
+        return cases
+
+    old = load(args.compare[0])
+    new = load(args.compare[1])
+
+    print(f'{"generator":10} {"options":>7} {"ballots":>8} {"engine":>10} {"old [s]":>9} {"new [s]":>9} {"ratio":>6}')
+    for key in sorted(old.keys() & new.keys()):
+        t_old = old[key]['total']
+        t_new = new[key]['total']
+        flag = '  <-- slower' if t_new > t_old * (1 + args.tolerance) else ''
+        print(f'{key[0]:10} {key[1]:7} {key[2]:8} {key[3]:>10} {t_old:9.4f} {t_new:9.4f} {t_new / t_old:6.2f}{flag}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark computation of results by the Schulze method')
+    parser.add_argument('--generators', nargs='+', choices=GENERATORS.keys(), default=list(GENERATORS.keys()),
+                        help='ballot generators to use (default: all)')
+    parser.add_argument('--options', nargs='+', type=int, default=[3, 5, 10, 20, 50, 100, 200, 500],
+                        help='numbers of options to try')
+    parser.add_argument('--ballots', nargs='+', type=int, default=[10, 100, 1000, 10**4, 10**5, 10**6],
+                        help='numbers of ballots to try')
+    parser.add_argument('--max-cells', type=float, default=1e9,
+                        help='skip cases with ballots * options^2 larger than this (default: 1e9)')
+    parser.add_argument('--engine', default='vectorized', help='strength engine to use')
+    parser.add_argument('--repeat', type=int, default=3, help='number of repetitions, the best time is reported (default: 3)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two outputs instead of running benchmarks')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown reported by --compare (default: 0.1)')
+    args = parser.parse_args()
+
+    if args.compare:
+        cmd_compare(args)
+    else:
+        cmd_run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,9 @@ CREATE TABLE elections (
 	config		jsonb		NOT NULL,
 	election_key	text		NOT NULL,
 	verify_key	text		NOT NULL,
-	"order"		int		NOT NULL DEFAULT 0
+	"order"		int		NOT NULL DEFAULT 0,
+	-- incremented on changes which invalidate data cached by web workers
+	serial		int		NOT NULL DEFAULT 0
 );
 
 -- H2 hashes of valid credentials
@@ -41,3 +43,26 @@ CREATE TABLE results (
 	election_id	int		NOT NULL REFERENCES elections(election_id),
 	result		jsonb		NOT NULL
 );
+
+-- Beat matrix maintained during voting (if RUNNING_TALLY is enabled) is the sum
+-- of deltas appended by individual votes, so that votes do not conflict
+CREATE TABLE tally_deltas (
+	delta_id	serial		PRIMARY KEY,
+	election_id	int		NOT NULL REFERENCES elections(election_id),
+	-- num_options x num_options matrix flattened by rows
+	beats		int[]		NOT NULL
+);
+
+CREATE INDEX tally_deltas_election_id ON tally_deltas (election_id);
+
+-- Numbers of rows in cred_hashes, ballots, and verifiers of each election are sums
+-- of deltas appended by registrations and votes, so that votes do not conflict
+CREATE TABLE count_deltas (
+	delta_id	serial		PRIMARY KEY,
+	election_id	int		NOT NULL REFERENCES elections(election_id),
+	num_voters	int		NOT NULL DEFAULT 0,
+	num_ballots	int		NOT NULL DEFAULT 0,
+	num_verifiers	int		NOT NULL DEFAULT 0
+);
+
+CREATE INDEX count_deltas_election_id ON count_deltas (election_id);
@@ -0,0 +1,146 @@
+# Icelect - Binary archive of ballots
+# (c) 2025 Martin Mareš <mj@ucw.cz>
+
+# The archive is a single file consisting of:
+#
+#   - magic line "ICELECT-BALLOTS 1\n"
+#   - header: a single line of JSON with keys "options", "num_ballots" and "dtype",
+#     padded with spaces so that the rank matrix is aligned to HEADER_ALIGN bytes
+#   - rank matrix: num_ballots x num_options small integers in row-major order
+#   - side table: a line "receipt<TAB>nonce\n" for each ballot, in the same order
+#
+# The rank matrix can be memory-mapped, so loading an archive does not
+# read or copy the ballots.
+
+import json
+import numpy as np
+import shutil
+import tempfile
+from typing import Iterator
+
+
+MAGIC = b'ICELECT-BALLOTS 1\n'
+HEADER_ALIGN = 64
+RANK_DTYPE = np.dtype('<i2')
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def is_ballot_archive(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BallotArchiveWriter:
+    """
+    Writes an archive incrementally. The rank matrix and the side table
+    are collected in temporary files, so memory does not grow with the
+    number of ballots.
+    """
+
+    path: str
+    options: list[str]
+    num_ballots: int
+
+    def __init__(self, path: str, options: list[str]):
+        self.path = path
+        self.options = options
+        self.num_ballots = 0
+        self.ranks_file = tempfile.TemporaryFile()
+        self.side_file = tempfile.TemporaryFile()
+
+    def __enter__(self) -> 'BallotArchiveWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.ranks_file.close()
+            self.side_file.close()
+
+    def add(self, receipts: list[str], nonces: list[str], ranks: np.ndarray) -> None:
+        ranks = np.asarray(ranks)
+        if ranks.shape != (len(receipts), len(self.options)) or len(nonces) != len(receipts):
+            raise ArchiveError('Ballots do not match the list of options')
+        limits = np.iinfo(RANK_DTYPE)
+        if ranks.size > 0 and (ranks.min() < limits.min or ranks.max() > limits.max):
+            raise ArchiveError('Rank out of range')
+
+        lines = []
+        for receipt, nonce in zip(receipts, nonces):
+            if any(c in receipt + nonce for c in '\t\n'):
+                raise ArchiveError(f'Receipt or nonce of ballot {receipt!r} contains a tab or a newline')
+            lines.append(f'{receipt}\t{nonce}\n')
+
+        self.ranks_file.write(ranks.astype(RANK_DTYPE, casting='same_kind').tobytes())
+        self.side_file.write(''.join(lines).encode('utf-8'))
+        self.num_ballots += len(receipts)
+
+    def close(self) -> None:
+        header = json.dumps({
+            'options': self.options,
+            'num_ballots': self.num_ballots,
+            'dtype': RANK_DTYPE.str,
+        }).encode('utf-8')
+        header_len = len(MAGIC) + len(header) + 1
+        padding = -header_len % HEADER_ALIGN
+
+        with open(self.path, 'wb') as out:
+            out.write(MAGIC)
+            out.write(header + b' ' * padding + b'\n')
+            for tmp in (self.ranks_file, self.side_file):
+                tmp.seek(0)
+                shutil.copyfileobj(tmp, out)
+                tmp.close()
+
+
+class BallotArchive:
+    """
+    Reads an archive. The rank matrix is memory-mapped.
+    """
+
+    path: str
+    options: list[str]
+    num_options: int
+    num_ballots: int
+    ranks: np.ndarray
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ArchiveError(f'{path}: Not a ballot archive')
+            try:
+                header = json.loads(f.readline())
+                self.options = header['options']
+                self.num_ballots = header['num_ballots']
+                dtype = np.dtype(header['dtype'])
+            except (ValueError, KeyError, TypeError):
+                raise ArchiveError(f'{path}: Invalid header')
+            self.ranks_offset = f.tell()
+
+        self.num_options = len(self.options)
+        shape = (self.num_ballots, self.num_options)
+        self.side_offset = self.ranks_offset + self.num_ballots * self.num_options * dtype.itemsize
+
+        if self.num_ballots > 0:
+            try:
+                self.ranks = np.memmap(path, dtype=dtype, mode='r', offset=self.ranks_offset, shape=shape)
+            except ValueError:
+                raise ArchiveError(f'{path}: Truncated archive')
+        else:
+            self.ranks = np.zeros(shape, dtype=dtype)
+
+    def receipts(self) -> Iterator[tuple[str, str]]:
+        """
+        Iterate over (receipt, nonce) pairs of all ballots.
+        """
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.side_offset)
+            for line in f:
+                receipt, nonce = line.decode('utf-8').rstrip('\n').split('\t')
+                yield receipt, nonce
@@ -1,6 +1,6 @@
 from enum import StrEnum, auto
 import logging
-from sqlalchemy import create_engine, ForeignKey
+from sqlalchemy import create_engine, Engine, ForeignKey, QueuePool
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, Session, relationship
 from sqlalchemy.orm import mapped_column as col
@@ -57,11 +57,14 @@ class Election(Base):
     election_key: Mapped[str]
     verify_key: Mapped[str]
     order: Mapped[int] = col(default=0)
+    serial: Mapped[int] = col(default=0)     # incremented on changes which invalidate cached data
 
     cred_hashes: Mapped['CredHash'] = relationship(back_populates='election')
     ballots: Mapped['Ballot'] = relationship(back_populates='election')
     verifiers: Mapped['Verifier'] = relationship(back_populates='election')
     results: Mapped['Result'] = relationship(back_populates='election')
+    tally_deltas: Mapped['TallyDelta'] = relationship(back_populates='election')
+    count_deltas: Mapped['CountDelta'] = relationship(back_populates='election')
 
 
 class CredHash(Base):
@@ -102,6 +105,30 @@ class Result(Base):
     election: Mapped[Election] = relationship()
 
 
+class TallyDelta(Base):
+    __tablename__ = 'tally_deltas'
+
+    delta_id: Mapped[int] = col(primary_key=True)
+    election_id: Mapped[ElectionId] = col(ForeignKey('elections.election_id'))
+    beats: Mapped[list[int]] = col(ARRAY(t.Integer))     # change of the beat matrix, flattened by rows
+
+    election: Mapped[Election] = relationship()
+
+
+class CountDelta(Base):
+    __tablename__ = 'count_deltas'
+
+    # Changes of the numbers of registered voters (cred_hashes), ballots and verifiers
+    delta_id: Mapped[int] = col(primary_key=True)
+    election_id: Mapped[ElectionId] = col(ForeignKey('elections.election_id'))
+    num_voters: Mapped[int] = col(default=0)
+    num_ballots: Mapped[int] = col(default=0)
+    num_verifiers: Mapped[int] = col(default=0)
+
+    election: Mapped[Election] = relationship()
+
+
+current_engine: Optional[Engine] = None
 current_session: Optional[Session] = None
 flask_db: Any = None
 
@@ -116,18 +143,69 @@ def get_session() -> Session:
     return current_session
 
 
-def new_session() -> Session:
-    engine = create_engine(
-        config.SQLALCHEMY_DATABASE_URI,
-        echo=config.SQLALCHEMY_ECHO,
-        isolation_level='SERIALIZABLE',
-    )
+def engine_options() -> dict[str, Any]:
+    """
+    Options of SQLAlchemy engines (except for the URI) derived from the configuration.
+    SQLALCHEMY_ENGINE_OPTIONS in the configuration override them.
+    """
 
-    sqla_logger = logging.getLogger('sqlalchemy.engine.base.Engine')
-    sqla_logger.addHandler(logging.NullHandler())
+    options: dict[str, Any] = {
+        'isolation_level': 'SERIALIZABLE',
+        'pool_size': getattr(config, 'DB_POOL_SIZE', 5),
+        'max_overflow': getattr(config, 'DB_MAX_OVERFLOW', 10),
+        'pool_timeout': getattr(config, 'DB_POOL_TIMEOUT', 30),
+        'pool_recycle': getattr(config, 'DB_POOL_RECYCLE', -1),
+        'pool_pre_ping': getattr(config, 'DB_POOL_PRE_PING', True),
+    }
+
+    statement_timeout = getattr(config, 'DB_STATEMENT_TIMEOUT', 0)
+    if statement_timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+
+    options.update(getattr(config, 'SQLALCHEMY_ENGINE_OPTIONS', {}))
+    return options
+
+
+def get_engine() -> Engine:
+    """
+    Engine used outside of the web application. It is created once per process,
+    so all sessions share its pool of connections.
+    """
 
-    if config.SQLALCHEMY_DEBUG:
-        logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
-        logging.getLogger("sqlalchemy.pool").setLevel(logging.DEBUG)
+    global current_engine
+    if current_engine is None:
+        current_engine = create_engine(
+            config.SQLALCHEMY_DATABASE_URI,
+            echo=config.SQLALCHEMY_ECHO,
+            **engine_options(),
+        )
 
-    return Session(engine)
+        sqla_logger = logging.getLogger('sqlalchemy.engine.base.Engine')
+        sqla_logger.addHandler(logging.NullHandler())
+
+        if config.SQLALCHEMY_DEBUG:
+            logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+            logging.getLogger("sqlalchemy.pool").setLevel(logging.DEBUG)
+
+    return current_engine
+
+
+def new_session() -> Session:
+    return Session(get_engine())
+
+
+def pool_stats(engine: Engine) -> dict[str, Any]:
+    """
+    Statistics of the connection pool of an engine, for monitoring.
+    """
+
+    pool = engine.pool
+    stats: dict[str, Any] = {'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    return stats
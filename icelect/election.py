@@ -1,21 +1,169 @@
 # Icelect - Representation of elections
 # (c) 2025 Martin Mareš <mj@ucw.cz>
 
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 import csv
-from sqlalchemy import select
+import numpy as np
+from sqlalchemy import delete, func, select, text
 import tomllib
-from typing import Any
+from typing import Any, Iterator, NamedTuple, TextIO
 
+from icelect.archive import BallotArchive
+import icelect.config as config
 from icelect.crypto import gen_key
 import icelect.db as db
 from icelect.json_walker import Walker, WalkerError
-from icelect.results import Results
+from icelect.results import Results, beat_matrix, collapse_ballots
 
 
 class ConfigError(ValueError):
     pass
 
 
+class BallotFileError(ValueError):
+    pass
+
+
+class ElectionCounts(NamedTuple):
+    num_voters: int = 0
+    num_ballots: int = 0
+    num_verifiers: int = 0
+
+
+def election_counts_for(election_ids: list[db.ElectionId]) -> dict[db.ElectionId, ElectionCounts]:
+    """
+    Numbers of registered voters, ballots and verifiers of given elections,
+    summed from their deltas. Deltas of elections which are not open for voting
+    are folded to a single row, so this is cheap for past elections.
+    Elections without deltas are missing.
+    """
+
+    if not election_ids:
+        return {}
+
+    sess = db.get_session()
+    rows = sess.execute(
+        select(db.CountDelta.election_id,
+               func.sum(db.CountDelta.num_voters),
+               func.sum(db.CountDelta.num_ballots),
+               func.sum(db.CountDelta.num_verifiers))
+        .filter(db.CountDelta.election_id.in_(election_ids))
+        .group_by(db.CountDelta.election_id)
+    )
+    return {eid: ElectionCounts(int(v), int(b), int(vf)) for eid, v, b, vf in rows}
+
+
+def election_counts(election_id: db.ElectionId) -> ElectionCounts:
+    sess = db.get_session()
+    v, b, vf = sess.execute(
+        select(func.coalesce(func.sum(db.CountDelta.num_voters), 0),
+               func.coalesce(func.sum(db.CountDelta.num_ballots), 0),
+               func.coalesce(func.sum(db.CountDelta.num_verifiers), 0))
+        .filter_by(election_id=election_id)
+    ).one()
+    return ElectionCounts(int(v), int(b), int(vf))
+
+
+def recount_election_counts(election_id: db.ElectionId) -> ElectionCounts:
+    """
+    Count rows of cred_hashes, ballots and verifiers, ignoring the deltas.
+    """
+
+    sess = db.get_session()
+    return ElectionCounts(*(
+        sess.scalar(select(func.count()).select_from(table).filter_by(election_id=election_id)) or 0
+        for table in (db.CredHash, db.Ballot, db.Verifier)
+    ))
+
+
+def fold_election_counts(election_id: db.ElectionId) -> None:
+    """
+    Replace all deltas of the counts by their sum. Deltas appended by
+    concurrent transactions are not visible to the DELETE, so they stay
+    and the sum remains exact.
+    """
+
+    sess = db.get_session()
+    sess.execute(text("""
+        WITH old AS (
+            DELETE FROM count_deltas WHERE election_id = :election_id
+            RETURNING num_voters, num_ballots, num_verifiers
+        )
+        INSERT INTO count_deltas (election_id, num_voters, num_ballots, num_verifiers)
+        SELECT :election_id, coalesce(sum(num_voters), 0), coalesce(sum(num_ballots), 0), coalesce(sum(num_verifiers), 0)
+        FROM old
+    """), {'election_id': election_id})
+
+
+def store_election_counts(election_id: db.ElectionId, counts: ElectionCounts) -> None:
+    """
+    Replace all deltas of the counts by a single one.
+    """
+
+    sess = db.get_session()
+    sess.execute(delete(db.CountDelta).filter_by(election_id=election_id))
+    sess.add(db.CountDelta(election_id=election_id, **counts._asdict()))
+
+
+class CsvBallotReader:
+    """
+    Streaming reader of ballots in the format of ballots.csv,
+    which produces chunks of ballots as compact integer arrays.
+    """
+
+    filename: str
+    options: list[str]
+    num_options: int
+    num_ballots: int
+
+    CHUNK_ROWS = 1 << 16
+
+    def __init__(self, file: TextIO, filename: str):
+        self.filename = filename
+        self.csr = csv.reader(file)
+        header = next(self.csr, None)
+        if header is None or len(header) < 4 or header[:2] != ['receipt', 'nonce']:
+            raise BallotFileError(f'{filename}: Invalid header')
+        self.options = header[2:]
+        self.num_options = len(self.options)
+        self.num_ballots = 0
+
+    def chunks(self, chunk_rows: int = CHUNK_ROWS) -> Iterator[tuple[list[str], list[str], np.ndarray]]:
+        """
+        Yield triples (receipts, nonces, ranks), where ranks is a 2D array
+        with one row per ballot.
+        """
+
+        width = self.num_options + 2
+        while True:
+            receipts = []
+            nonces = []
+            ranks = []
+            for row in self.csr:
+                if len(row) != width:
+                    raise BallotFileError(f'{self.filename}:{self.csr.line_num}: Expected {width} columns, found {len(row)}')
+                receipts.append(row[0])
+                nonces.append(row[1])
+                try:
+                    ranks.append([int(r) for r in row[2:]])
+                except ValueError:
+                    raise BallotFileError(f'{self.filename}:{self.csr.line_num}: Invalid rank')
+                if len(ranks) >= chunk_rows:
+                    break
+
+            if not ranks:
+                return
+
+            try:
+                chunk = np.array(ranks, dtype=np.int16)
+            except OverflowError:
+                raise BallotFileError(f'{self.filename}: Rank out of range near line {self.csr.line_num}')
+
+            self.num_ballots += len(ranks)
+            yield receipts, nonces, chunk
+
+
 class ElectionData:
     ident: str
     title: str
@@ -25,9 +173,12 @@ class ElectionData:
     election_key: str
     verify_key: str
     ballots: list[db.Ballot]
+    num_ballots: int
+    beats: np.ndarray | None    # if set, results are computed from this beat matrix instead of ballots
 
     def __init__(self, ident: str):
         self.ident = ident
+        self.beats = None
 
     @classmethod
     def from_config_file(cls, ident: str) -> 'ElectionData':
@@ -68,34 +219,201 @@ class ElectionData:
             raise ConfigError(str(err))
 
     @classmethod
-    def from_csv_ballots(cls, filename: str) -> 'ElectionData':
+    def from_csv_ballots(cls, filename: str, workers: int = 1, chunk_rows: int = CsvBallotReader.CHUNK_ROWS) -> 'ElectionData':
+        """
+        Load ballots from a CSV file in the format of ballots.csv.
+        Only the beat matrix is kept, so memory does not grow with the number of ballots.
+        With multiple workers, chunks of ballots are counted in parallel.
+        """
+
         with open(filename) as f:
-            csr = csv.reader(f)
-            header = next(csr)
-            assert len(header) > 3
-            assert header[0] == 'receipt'
-            assert header[1] == 'nonce'
+            reader = CsvBallotReader(f, filename)
             ed = ElectionData(filename)
             ed.title = filename
-            ed.options = header[2:]
-            ed.num_options = len(ed.options)
+            ed.options = reader.options
+            ed.num_options = reader.num_options
 
-            ed.ballots = []
-            for row in csr:
-                assert len(row) == len(header)
-                ed.ballots.append(db.Ballot(
-                    electio_id=0,
-                    receipt=row[0],
-                    nonce=row[1],
-                    ranks=[int(r) for r in row[2:]],
-                ))
+            ed.beats = np.zeros((ed.num_options, ed.num_options), dtype=np.int32)
+            if workers > 1:
+                with ProcessPoolExecutor(workers) as pool:
+                    pending: deque[Future] = deque()
+                    for _, _, ranks in reader.chunks(chunk_rows):
+                        pending.append(pool.submit(beat_matrix, ed.num_options, ranks))
+                        if len(pending) >= 2 * workers:
+                            ed.beats += pending.popleft().result()
+                    for future in pending:
+                        ed.beats += future.result()
+            else:
+                for _, _, ranks in reader.chunks(chunk_rows):
+                    ed.beats += beat_matrix(ed.num_options, ranks)
 
+            ed.ballots = []
+            ed.num_ballots = reader.num_ballots
             return ed
 
+    @classmethod
+    def from_ballot_archive(cls, filename: str, workers: int = 1) -> 'ElectionData':
+        """
+        Load ballots from a binary archive (see icelect.archive).
+        The rank matrix is memory-mapped and counted without copying.
+        """
+
+        archive = BallotArchive(filename)
+        ed = ElectionData(filename)
+        ed.title = filename
+        ed.options = archive.options
+        ed.num_options = archive.num_options
+        ed.beats = beat_matrix(ed.num_options, archive.ranks, workers=workers)
+        ed.ballots = []
+        ed.num_ballots = archive.num_ballots
+        return ed
+
     def ballots_from_db(self, election: db.Election) -> None:
         sess = db.get_session()
         # FIXME: Replace with iterating a relationship
         self.ballots = list(sess.scalars(select(db.Ballot).filter_by(election=election)))
+        self.num_ballots = len(self.ballots)
+
+    def beats_from_db(self, election: db.Election) -> None:
+        """
+        Compute the beat matrix inside the database, so that only
+        num_options^2 numbers are transferred instead of all ballots.
+        """
+
+        sess = db.get_session()
+        params = {'election_id': election.election_id, 'num_options': self.num_options}
+
+        bad_ballots = sess.scalar(text(
+            "SELECT count(*) FROM ballots WHERE election_id = :election_id AND cardinality(ranks) <> :num_options"
+        ), params)
+        if bad_ballots:
+            raise ValueError(f'Found {bad_ballots} ballots with a wrong number of ranks')
+
+        self.beats = np.zeros((self.num_options, self.num_options), dtype=np.int32)
+        rows = sess.execute(text("""
+            SELECT a.pos - 1, b.pos - 1, count(*)
+            FROM ballots,
+                 unnest(ballots.ranks) WITH ORDINALITY AS a(rank, pos),
+                 unnest(ballots.ranks) WITH ORDINALITY AS b(rank, pos)
+            WHERE ballots.election_id = :election_id AND a.rank < b.rank
+            GROUP BY a.pos, b.pos
+        """), params)
+        for i, j, count in rows:
+            self.beats[i, j] = count
+
+    def collapsed_ballots(self) -> tuple[np.ndarray, np.ndarray]:
+        return collapse_ballots(self.num_options, [b.ranks for b in self.ballots])
+
+    def recount_beats(self) -> np.ndarray:
+        return beat_matrix(self.num_options, *self.collapsed_ballots())
+
+    def tally_from_db(self, election: db.Election) -> bool:
+        """
+        Use the beat matrix maintained during voting. Returns False if there is none.
+        """
+
+        sess = db.get_session()
+        beats = sess.scalar(text("""
+            SELECT array_agg(total ORDER BY k)
+            FROM (
+                SELECT k, sum(b) AS total
+                FROM tally_deltas, unnest(tally_deltas.beats) WITH ORDINALITY AS u(b, k)
+                WHERE election_id = :election_id
+                GROUP BY k
+            ) AS sums
+        """), {'election_id': election.election_id})
+        if beats is None:
+            return False
+        self.beats = np.array(beats, dtype=np.int32).reshape(self.num_options, self.num_options)
+        return True
+
+    def store_tally(self, election: db.Election, beats: np.ndarray) -> None:
+        """
+        Replace all deltas of the running tally by a single one.
+        """
+
+        sess = db.get_session()
+        sess.execute(delete(db.TallyDelta).filter_by(election_id=election.election_id))
+        sess.add(db.TallyDelta(election_id=election.election_id, beats=beats.flatten().tolist()))
+
+    def record_ballots(self, election_id: db.ElectionId, ballots: list[tuple[str, str, str, list[int]]]) -> bool:
+        """
+        Record ballots given as (receipt, nonce, verifier, ranks), possibly
+        overwriting older ballots with the same receipts, insert their verifiers
+        and append the change of the numbers of ballots and verifiers to
+        count_deltas, all in a single statement. Receipts must be distinct.
+
+        The statement writes nothing unless the election is in the voting state,
+        so a retried transaction cannot record ballots after voting was closed.
+        Returns False in that case.
+
+        If RUNNING_TALLY is enabled in the configuration, the statement also
+        appends the change of the beat matrix to the running tally. All parts
+        of the statement see the same snapshot, so old ballots are read before
+        they are overwritten.
+        """
+
+        if getattr(config, 'RUNNING_TALLY', False):
+            tally_ctes = """
+                , old AS (
+                    SELECT input.idx, ballots.ranks
+                    FROM input JOIN ballots ON ballots.election_id = :election_id AND ballots.receipt = input.receipt
+                ), new_tally_delta AS (
+                    INSERT INTO tally_deltas (election_id, beats)
+                    SELECT :election_id, array_agg(d ORDER BY i, j)
+                    FROM (
+                        SELECT i, j, sum((input.ranks[i] < input.ranks[j])::int - coalesce((old.ranks[i] < old.ranks[j])::int, 0)) AS d
+                        FROM input LEFT JOIN old USING (idx)
+                             CROSS JOIN generate_series(1, :num_options) AS i
+                             CROSS JOIN generate_series(1, :num_options) AS j
+                        GROUP BY i, j
+                    ) AS pairs
+                    HAVING count(*) > 0
+                )
+            """
+        else:
+            tally_ctes = ""
+
+        sess = db.get_session()
+        recorded = sess.scalar(text("""
+            WITH input AS (
+                SELECT x.idx, x.receipt, x.nonce, x.verifier,
+                       r.flat[(x.idx - 1) * :num_options + 1 : x.idx * :num_options] AS ranks
+                FROM unnest(CAST(:receipts AS text[]), CAST(:nonces AS text[]), CAST(:verifiers AS text[]))
+                         WITH ORDINALITY AS x(receipt, nonce, verifier, idx),
+                     (SELECT CAST(:ranks AS int[]) AS flat) AS r
+                WHERE EXISTS (SELECT 1 FROM elections WHERE election_id = :election_id AND state = 'voting')
+            ), new_verifiers AS (
+                INSERT INTO verifiers (election_id, verifier)
+                SELECT :election_id, verifier FROM input
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            ), new_ballots AS (
+                INSERT INTO ballots (election_id, receipt, nonce, ranks)
+                SELECT :election_id, receipt, nonce, CAST(ranks AS smallint[]) FROM input
+                ON CONFLICT (election_id, receipt) DO UPDATE SET nonce = EXCLUDED.nonce, ranks = EXCLUDED.ranks
+                RETURNING xmax = 0 AS inserted     -- false if an existing ballot was updated
+            ), new_count_delta AS (
+                INSERT INTO count_deltas (election_id, num_ballots, num_verifiers)
+                SELECT :election_id, b.n, v.n
+                FROM (SELECT count(*) AS n FROM new_ballots WHERE inserted) AS b,
+                     (SELECT count(*) AS n FROM new_verifiers) AS v
+                WHERE b.n > 0 OR v.n > 0
+            )
+        """ + tally_ctes + """
+            SELECT count(*) FROM new_ballots
+        """), {
+            'election_id': election_id,
+            'num_options': self.num_options,
+            'receipts': [b[0] for b in ballots],
+            'nonces': [b[1] for b in ballots],
+            'verifiers': [b[2] for b in ballots],
+            'ranks': [r for b in ballots for r in b[3]],
+        })
+        return recorded > 0
 
-    def results(self) -> 'Results':
-        return Results(self.num_options, [b.ranks for b in self.ballots])
+    def results(self, workers: int = 1, trace_memory: bool = False) -> 'Results':
+        if self.beats is not None:
+            return Results(self.num_options, [], beats=self.beats, trace_memory=trace_memory)
+        ranks, counts = self.collapsed_ballots()
+        return Results(self.num_options, ranks, counts, workers=workers, trace_memory=trace_memory)
@@ -10,65 +10,229 @@
 #
 # https://electowiki.org/wiki/Schulze_method
 
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from typing import Any
+import time
+import tracemalloc
+from typing import Any, Callable
+
+
+# Number of options from which the 'auto' strength engine tries
+# the incremental algorithm before Floyd-Warshall. Below it, Floyd-Warshall
+# on the compact matrix fits in cache and wins even if few beats are useful
+# (measured by bench/bench_results.py).
+AUTO_INCREMENTAL_OPTIONS = 3000
+
+# Number of beats the incremental algorithm filters at once.
+INCREMENTAL_BLOCK = 4096
+
+# Upper bound on the number of cells of the temporary comparison array
+# used when computing beats, so that memory stays bounded.
+BEATS_CHUNK_CELLS = 1 << 24
+
+
+def beat_matrix(num_options: int, ballots: Any, counts: Any = None, workers: int = 1) -> np.ndarray:
+    """
+    Compute the beat matrix of a list (or 2D array) of ballots:
+    beats[i,j] tells how many ballots prefer i to j.
+
+    If counts are given, the i-th ballot is counted counts[i] times.
+
+    Ballots are processed in chunks, each compared at once using NumPy.
+    With multiple workers, ballots are split to shards, which are
+    processed in parallel by a pool of processes.
+    """
+
+    ranks = _rank_matrix(num_options, ballots)
+    if counts is not None:
+        counts = np.asarray(counts)
+        assert counts.shape == (len(ranks),)
+
+    chunk = max(1, BEATS_CHUNK_CELLS // (num_options * num_options))
+    if workers > 1 and len(ranks) > chunk:
+        return _sharded_beat_matrix(num_options, ranks, counts, workers)
+
+    beats = np.zeros((num_options, num_options), dtype=np.int32)
+
+    for start in range(0, len(ranks), chunk):
+        r = ranks[start : start + chunk]
+        prefers = r[:, :, None] < r[:, None, :]
+        if counts is None:
+            beats += np.count_nonzero(prefers, axis=0).astype(np.int32)
+        else:
+            beats += np.tensordot(counts[start : start + chunk], prefers, axes=1).astype(np.int32)
+
+    return beats
+
+
+def _sharded_beat_matrix(num_options: int, ranks: np.ndarray, counts: np.ndarray | None, workers: int) -> np.ndarray:
+    bounds = np.linspace(0, len(ranks), workers + 1, dtype=int)
+    shards = [slice(bounds[i], bounds[i + 1]) for i in range(workers)]
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(beat_matrix, num_options, ranks[s], counts[s] if counts is not None else None)
+            for s in shards
+        ]
+        beats = np.zeros((num_options, num_options), dtype=np.int32)
+        for f in futures:
+            beats += f.result()
+
+    return beats
+
+
+def collapse_ballots(num_options: int, ballots: Any) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Collapse identical ballots. Returns an array of distinct ballots
+    and an array of their multiplicities.
+    """
+
+    ranks = np.ascontiguousarray(_rank_matrix(num_options, ballots))
+
+    # Comparing rows as opaque byte strings is much faster than np.unique(axis=0)
+    rows = ranks.view(np.dtype((np.void, ranks.dtype.itemsize * num_options))).ravel()
+    distinct, counts = np.unique(rows, return_counts=True)
+    return distinct.view(ranks.dtype).reshape(-1, num_options), counts
+
+
+def beat_weights(beats: np.ndarray) -> np.ndarray:
+    """
+    Compute beat weights: if i beats j, then weights[i,j] = beats[i,j] - beats[j,i].
+    """
+
+    return np.maximum(beats - beats.T, 0)
+
+
+def compact_matrix(mat: np.ndarray) -> np.ndarray:
+    """
+    Convert a matrix of non-negative integers to the smallest signed integer
+    type which can hold all its entries (signed, so that the matrix can be
+    safely subtracted from its transpose).
+    """
+
+    top = int(mat.max()) if mat.size > 0 else 0
+    return mat.astype(np.min_scalar_type(-top - 1), copy=False)
+
+
+def _rank_matrix(num_options: int, ballots: Any) -> np.ndarray:
+    ranks = np.asarray(ballots)
+    if ranks.size == 0:
+        ranks = ranks.reshape(0, num_options)
+    assert ranks.ndim == 2 and ranks.shape[1] == num_options
+    return ranks
 
 
 class Results:
 
     num_options: int
-    ballots: list[list[int]]    # each ballot is a list of ranks
+    ballots: list[list[int]] | np.ndarray | None    # each ballot is a list of ranks (None if not kept)
+    counts: list[int] | np.ndarray | None           # multiplicities of ballots (None if all are 1)
 
+    # Matrices use the smallest integer type which can hold their entries.
+    # Weights and the stronger-than relation are not kept, since they can be
+    # recomputed from beats and strengths (see beat_weights() and stronger).
     beats: np.ndarray
     condorcet_winner: int | None
     weak_condorcet_winners: list[int]
-    weights: np.ndarray
     strengths: np.ndarray
-    stronger: np.ndarray
     schulze_order: list[list[int]]
 
-    def __init__(self, num_options: int, ballots: list[list[int]]):
+    strength_engine: str        # 'auto', 'vectorized', 'incremental' or 'loop' (reference implementation)
+    workers: int                # number of processes used to compute beats
+    keep_ballots: bool          # keep ballots after computing beats
+
+    trace_memory: bool          # measure peak memory allocated by each phase (slow)
+    timings: dict[str, float]   # phase name -> wall-clock time in seconds
+    peak_memory: dict[str, int] # phase name -> peak allocated memory in bytes (if trace_memory)
+
+    def __init__(self,
+                 num_options: int,
+                 ballots: list[list[int]] | np.ndarray,
+                 counts: list[int] | np.ndarray | None = None,
+                 strength_engine: str = 'auto',
+                 beats: np.ndarray | None = None,
+                 workers: int = 1,
+                 trace_memory: bool = False,
+                 keep_ballots: bool = False):
         self.num_options = num_options
         self.ballots = ballots
-        self._calc_beats()
-        self._calc_condorcet()
-        self._calc_weights()
-        self._calc_strengths()
-        self._calc_winners()
+        self.counts = counts
+        self.strength_engine = strength_engine
+        self.workers = workers
+        self.keep_ballots = keep_ballots
+        self.trace_memory = trace_memory
+        self.timings = {}
+        self.peak_memory = {}
+
+        tracing = trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+
+        if beats is None:
+            self._run_phase('beats', self._calc_beats)
+        else:
+            # Beat matrix computed elsewhere (e.g., maintained during voting)
+            assert beats.shape == (num_options, num_options)
+            self.beats = compact_matrix(beats)
+        if not keep_ballots:
+            self.ballots = None
+            self.counts = None
+        self._run_phase('condorcet', self._calc_condorcet)
+        self._run_phase('weights', self._calc_weights)
+        self._run_phase('strengths', self._calc_strengths)
+        del self.weights
+        self._run_phase('winners', self._calc_winners)
+
+        if tracing:
+            tracemalloc.stop()
+
+    def _run_phase(self, name: str, phase: Callable[[], None]) -> None:
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        phase()
+        self.timings[name] = time.perf_counter() - start
+
+        if self.trace_memory:
+            self.peak_memory[name] = tracemalloc.get_traced_memory()[1] - base
 
     def _calc_beats(self):
         """
         Compute the beat matrix: beats[i,j] tells how many ballots prefer i to j.
         """
 
-        self.beats = np.zeros((self.num_options, self.num_options), dtype=np.int32)
-
-        for rank in self.ballots:
-            assert len(rank) == self.num_options
-            for i in range(self.num_options):
-                for j in range(self.num_options):
-                    if i != j and rank[i] < rank[j]:
-                        self.beats[i,j] += 1
+        self.beats = compact_matrix(beat_matrix(self.num_options, self.ballots, self.counts, self.workers))
 
     def _calc_condorcet(self):
         """
         Compute the strong Condorcet winner and the set of weak Condorcet winners.
         """
 
-        self.condorcet_winner = None
-        self.weak_condorcet_winners = []
-        for i in range(self.num_options):
-            if all(self.beats[i,j] > self.beats[j,i] or i == j for j in range(self.num_options)):
-                self.condorcet_winner = i
-            if all(self.beats[i,j] >= self.beats[j,i] or i == j for j in range(self.num_options)):
-                self.weak_condorcet_winners.append(i)
+        wins = self.beats > self.beats.T
+        np.fill_diagonal(wins, True)
+        strong = np.flatnonzero(wins.all(axis=1))    # there is at most one
+        self.condorcet_winner = int(strong[0]) if len(strong) > 0 else None
+
+        not_lost = self.beats >= self.beats.T
+        self.weak_condorcet_winners = np.flatnonzero(not_lost.all(axis=1)).tolist()
 
     def _calc_weights(self):
         """
-        Compute beat weights: if i beats j, then weights[i,j] = beats[i,j] - beats[j,i].
+        Compute beat weights, which are needed only while computing strengths.
+        """
+
+        self.weights = beat_weights(self.beats)
+
+    @property
+    def stronger(self) -> np.ndarray:
+        """
+        Path-beat relation: stronger[i,j] tells if the strongest path from i to j
+        is stronger than the strongest path from j to i. It is computed on each access.
         """
 
-        self.weights = np.maximum(self.beats - self.beats.T, 0)
+        return self.strengths > self.strengths.T
 
     def _calc_strengths(self):
         """
@@ -76,8 +240,33 @@ class Results:
         from i to j, where the strength of a path is the minimum weight on its edges.
         """
 
-        self.strengths = self.weights.copy()
-        s = self.strengths
+        engine = self.strength_engine
+        if engine == 'loop':
+            self.strengths = self._strengths_loop()
+        elif engine == 'vectorized':
+            self.strengths = self._strengths_vectorized()
+        elif engine == 'incremental':
+            self.strengths = self._strengths_incremental()
+        elif engine == 'auto':
+            # The incremental algorithm wins for large elections, unless
+            # too many beats are useful (e.g., if the beat graph is nearly
+            # acyclic). Then we fall back to Floyd-Warshall.
+            n = self.num_options
+            strengths = None
+            if n >= AUTO_INCREMENTAL_OPTIONS:
+                strengths = self._strengths_incremental(budget=n * n // 16)
+            if strengths is None:
+                strengths = self._strengths_vectorized()
+            self.strengths = strengths
+        else:
+            raise ValueError(f'Unknown strength engine {self.strength_engine}')
+
+    def _strengths_loop(self) -> np.ndarray:
+        """
+        Reference implementation of the Floyd-Warshall algorithm.
+        """
+
+        s = self.weights.copy()
 
         for k in range(self.num_options):
             for i in range(self.num_options):
@@ -86,52 +275,319 @@ class Results:
                         if i != j and j != k:
                             s[i,j] = max(s[i,j], min(s[i,k], s[k,j]))
 
-        self.stronger = self.strengths > self.strengths.T
+        return s
+
+    def _strengths_vectorized(self) -> np.ndarray:
+        """
+        Floyd-Warshall algorithm updating the whole matrix in each step.
+
+        Paths through k never change entries in row k and column k, so the
+        whole matrix can be updated at once. Entries on the diagonal can grow
+        (unlike in the reference implementation), so we reset them at the end.
+        """
+
+        s = self.weights.copy()
+
+        for k in range(self.num_options):
+            np.maximum(s, np.minimum(s[:, k, None], s[None, k, :]), out=s)
+
+        np.fill_diagonal(s, 0)
+        return s
+
+    def _strengths_incremental(self, budget: int | None = None) -> np.ndarray | None:
+        """
+        Add beats to an empty graph in order of decreasing weight (like in
+        Kruskal's algorithm for maximum spanning trees) and maintain reachability.
+        When j becomes reachable from i, the weight of the beat just added
+        is the strength of the strongest path from i to j.
+
+        Beats which do not create new paths are filtered out in bulk, so if
+        only few beats are useful, this takes O(n^2 log n) time for sorting
+        the beats plus O(n) per useful beat. If there are more than budget
+        useful beats, we give up and return None.
+        """
+
+        n = self.num_options
+        w = self.weights
+        s = np.zeros_like(w)
+        reach = np.eye(n, dtype=bool)       # reach[i,j]: j is reachable from i
+        reach_t = np.eye(n, dtype=bool)     # transposed, so that columns are contiguous
+        unreached = n * (n - 1)
+        useful = 0
+
+        src, dst = np.nonzero(w > 0)
+        order = np.argsort(-w[src, dst], kind='stable')
+        src = src[order]
+        dst = dst[order]
+
+        for start in range(0, len(src), INCREMENTAL_BLOCK):
+            block_src = src[start : start + INCREMENTAL_BLOCK]
+            block_dst = dst[start : start + INCREMENTAL_BLOCK]
+            candidates = np.flatnonzero(~reach[block_src, block_dst])
+
+            for u, v in zip(block_src[candidates].tolist(), block_dst[candidates].tolist()):
+                if reach[u, v]:
+                    continue
+
+                useful += 1
+                if budget is not None and useful > budget:
+                    return None
+
+                # Options reaching u, but not v yet, now reach everything reachable from v
+                rows = np.flatnonzero(reach_t[u] > reach_t[v])
+                if len(rows) == 1:
+                    a = rows[0]
+                    new_cols = np.flatnonzero(reach[v] > reach[a])
+                    s[a, new_cols] = w[u, v]
+                    reach[a, new_cols] = True
+                    reach_t[new_cols, a] = True
+                    unreached -= len(new_cols)
+                else:
+                    sub_reach = reach[rows]
+                    new = reach[v] > sub_reach
+                    sub_s = s[rows]
+                    sub_s[new] = w[u, v]
+                    s[rows] = sub_s
+                    reach[rows] = sub_reach | new
+                    new_cols = np.flatnonzero(new.any(axis=0))
+                    reach_t[np.ix_(new_cols, rows)] |= new[:, new_cols].T
+                    unreached -= np.count_nonzero(new)
+
+            if unreached == 0:
+                break
+
+        return s
 
     def _calc_winners(self):
         """
         Compute Schulze layers. The first layer is the winners.
-        """
 
-        self.schulze_order = []
-        remains = set(range(self.num_options))
+        The layer of an option is the length of the longest chain of options
+        path-beating each other which ends with this option. As the path-beat
+        relation is transitive, an option path-beats more options than anything
+        it path-beats, so ordering options by the number of path-beaten options
+        yields a topological order, in which layers can be computed in one pass.
+        """
 
-        while remains:
-            layer = remains.copy()
+        stronger = self.stronger
+        dominance = np.count_nonzero(stronger, axis=1)
+        layer = np.zeros(self.num_options, dtype=int)
 
-            for i in remains:
-                for j in remains:
-                    if self.stronger[i,j]:
-                        layer.discard(j)
+        for j in np.argsort(-dominance, kind='stable'):
+            beaten_by = stronger[:, j]
+            if beaten_by.any():
+                layer[j] = layer[beaten_by].max() + 1
 
-            self.schulze_order.append(sorted(layer))
-            remains -= layer
+        self.schulze_order = [np.flatnonzero(layer == k).tolist() for k in range(layer.max() + 1)]
 
     def debug(self):
         print(f'Number of options: {self.num_options}')
         print('Ballots:')
-        for r in self.ballots:
-            print(f'\t{r}')
+        if self.ballots is None:
+            print('\t(not kept)')
+        elif self.counts is None:
+            for r in self.ballots:
+                print(f'\t{list(map(int, r))}')
+        else:
+            for r, c in zip(self.ballots, self.counts):
+                print(f'\t{c}x {list(map(int, r))}')
         print('Beats:', self.beats)
         print('Condorcet winner:', self.condorcet_winner)
         print('Weak Condorcet winners:', self.weak_condorcet_winners)
-        print('Weights:', self.weights)
+        print('Weights:', beat_weights(self.beats))
         print('Path strengths:', self.strengths)
         print('Stronger than relation:', self.stronger)
         print('Schulze order:', self.schulze_order)
+        self.debug_profile()
 
-    def to_json(self) -> Any:
-        def jsonify_matrix(mat: np.ndarray) -> list[list[int]]:
-            return [
-                [int(mat[i,j]) for j in range(self.num_options)]
-                for i in range(self.num_options)
-            ]
+    def debug_profile(self) -> None:
+        print('Profile:')
+        for name, t in self.timings.items():
+            if name in self.peak_memory:
+                print(f'\t{name:10} {t:10.6f} s {self.peak_memory[name] / 2**20:10.3f} MiB')
+            else:
+                print(f'\t{name:10} {t:10.6f} s')
 
+    def profile_json(self) -> Any:
         return {
-            'beats': jsonify_matrix(self.beats),
+            name: {'time': t, 'peak_memory': self.peak_memory.get(name)}
+            for name, t in self.timings.items()
+        }
+
+    def to_json(self, profile: bool = False) -> Any:
+        # Weights are not stored, they can be computed from beats by beat_weights()
+        out = {
+            'beats': self.beats.tolist(),
             'condorcet_winner': self.condorcet_winner,
             'weak_condorcet_winners': self.weak_condorcet_winners,
-            'weights': jsonify_matrix(self.weights),
-            'strengths': jsonify_matrix(self.strengths),
+            'strengths': self.strengths.tolist(),
             'schulze_order': self.schulze_order,
         }
+        if profile:
+            out['profile'] = self.profile_json()
+        return out
+
+
+class BatchResults:
+    """
+    Results of many elections over the same set of options computed at once,
+    e.g., for Monte Carlo or bootstrap estimates of robustness of the results.
+
+    Either ranks is a 3D array (K replicates x B ballots x n options),
+    or ranks is a 2D array of ballots shared by all replicates and counts
+    is a 2D array (K x B) of their multiplicities in each replicate.
+    The latter is much cheaper, so it is preferred for resampling
+    collapsed ballots (see resample_counts()).
+
+    Everything is computed by batched NumPy operations over all replicates.
+    """
+
+    num_options: int
+    num_replicates: int
+
+    beats: np.ndarray               # K x n x n
+    condorcet_winners: np.ndarray   # K, -1 if there is no Condorcet winner
+    weights: np.ndarray             # K x n x n
+    strengths: np.ndarray           # K x n x n
+    stronger: np.ndarray            # K x n x n
+    layers: np.ndarray              # K x n: Schulze layer of each option, winners have 0
+
+    def __init__(self, num_options: int, ranks: np.ndarray, counts: np.ndarray | None = None):
+        self.num_options = num_options
+        ranks = np.asarray(ranks)
+
+        if counts is None:
+            assert ranks.ndim == 3 and ranks.shape[2] == num_options
+            self.num_replicates = ranks.shape[0]
+            self.beats = self._stacked_beats(ranks)
+        else:
+            counts = np.asarray(counts)
+            ranks = _rank_matrix(num_options, ranks)
+            assert counts.ndim == 2 and counts.shape[1] == len(ranks)
+            self.num_replicates = counts.shape[0]
+            self.beats = self._weighted_beats(ranks, counts)
+
+        self._calc_condorcet()
+        self._calc_weights()
+        self._calc_strengths()
+        self._calc_winners()
+
+    def _stacked_beats(self, ranks: np.ndarray) -> np.ndarray:
+        n = self.num_options
+        beats = np.zeros((self.num_replicates, n, n), dtype=np.int32)
+        chunk = max(1, BEATS_CHUNK_CELLS // (max(1, self.num_replicates) * n * n))
+
+        for start in range(0, ranks.shape[1], chunk):
+            r = ranks[:, start : start + chunk]
+            beats += np.count_nonzero(r[:, :, :, None] < r[:, :, None, :], axis=1).astype(np.int32)
+
+        return beats
+
+    def _weighted_beats(self, ranks: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        n = self.num_options
+        beats = np.zeros((self.num_replicates, n * n), dtype=np.int32)
+        chunk = max(1, BEATS_CHUNK_CELLS // (n * n))
+
+        for start in range(0, len(ranks), chunk):
+            r = ranks[start : start + chunk]
+            prefers = (r[:, :, None] < r[:, None, :]).reshape(len(r), n * n)
+            # Matrix product in floating point uses BLAS and it is exact
+            # as long as the sums stay below 2^53.
+            c = counts[:, start : start + chunk].astype(np.float64)
+            beats += np.rint(c @ prefers.astype(np.float64)).astype(np.int32)
+
+        return beats.reshape(self.num_replicates, n, n)
+
+    def _calc_condorcet(self):
+        beats_t = self.beats.transpose(0, 2, 1)
+        wins = self.beats > beats_t
+        wins[:, np.arange(self.num_options), np.arange(self.num_options)] = True
+        strong = wins.all(axis=2)
+        self.condorcet_winners = np.where(strong.any(axis=1), strong.argmax(axis=1), -1)
+
+    def _calc_weights(self):
+        self.weights = np.maximum(self.beats - self.beats.transpose(0, 2, 1), 0)
+
+    def _calc_strengths(self):
+        """
+        Floyd-Warshall algorithm as in Results._strengths_vectorized(),
+        but updating all replicates in each step.
+        """
+
+        s = self.weights.copy()
+
+        for k in range(self.num_options):
+            np.maximum(s, np.minimum(s[:, :, k, None], s[:, None, k, :]), out=s)
+
+        s[:, np.arange(self.num_options), np.arange(self.num_options)] = 0
+        self.strengths = s
+        self.stronger = s > s.transpose(0, 2, 1)
+
+    def _calc_winners(self):
+        """
+        Peel off Schulze layers of all replicates simultaneously: each layer
+        consists of remaining options not path-beaten by any remaining option.
+        """
+
+        layers = np.full((self.num_replicates, self.num_options), -1)
+        remaining = np.ones((self.num_replicates, self.num_options), dtype=bool)
+        layer = 0
+
+        while remaining.any():
+            beaten = (self.stronger & remaining[:, :, None]).any(axis=1)
+            current = remaining & ~beaten
+            layers[current] = layer
+            remaining &= ~current
+            layer += 1
+
+        self.layers = layers
+
+    @property
+    def winners(self) -> np.ndarray:
+        """
+        K x n boolean array: winners[k,i] tells if option i is a Schulze winner in replicate k.
+        """
+
+        return self.layers == 0
+
+    def winner_frequency(self) -> np.ndarray:
+        """
+        For each option, the fraction of replicates where it is a Schulze winner.
+        """
+
+        return self.winners.mean(axis=0)
+
+    def schulze_order(self, replicate: int) -> list[list[int]]:
+        """
+        Schulze order of a single replicate in the format of Results.schulze_order.
+        """
+
+        layers = self.layers[replicate]
+        return [np.flatnonzero(layers == k).tolist() for k in range(layers.max() + 1)]
+
+
+def resample_counts(rng: np.random.Generator,
+                    counts: np.ndarray,
+                    num_replicates: int,
+                    sample_size: int | None = None,
+                    replace: bool = True) -> np.ndarray:
+    """
+    Resample collapsed ballots with multiplicities given by counts.
+    Returns a num_replicates x len(counts) array of new multiplicities.
+
+    With replace=True, we draw a bootstrap sample of sample_size ballots
+    (by default as many as there were). With replace=False, we keep
+    a random subset of sample_size ballots; e.g., sample_size equal to 95%
+    of the ballots simulates dropping 5% of them.
+    """
+
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if sample_size is None:
+        sample_size = total
+
+    if replace:
+        return rng.multinomial(sample_size, counts / max(total, 1), size=num_replicates)
+    else:
+        assert sample_size <= total
+        return rng.multivariate_hypergeometric(counts, sample_size, size=num_replicates)
@@ -1,26 +1,39 @@
 # Icelect - The web application
 # (c) 2025 Martin Mareš <mj@ucw.cz>
 
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
 import csv
-from flask import Flask, request, session, redirect, url_for, render_template, Response, g
+from flask import Flask, request, session, redirect, url_for, render_template, make_response, Response, g, stream_with_context
 from flask.helpers import flash
 import flask.logging
 from flask.views import View
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import FlaskForm
+from functools import cache
+import hashlib
 from io import StringIO
 import os
+import numpy as np
+import queue
+import random
 import re
-from sqlalchemy import select, func
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, exists
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import defer
+import threading
+import time
+from typing import Callable, Iterable, Iterator
 import werkzeug.exceptions
 import wtforms
 import wtforms.validators as validators
+import zlib
 
 import icelect.config as config
 from icelect.crypto import cred_to_h1, cred_to_h2, h1_to_receipt, h1_to_verifier
 import icelect.db as db
-from icelect.election import ElectionData
+from icelect.election import ElectionCounts, ElectionData, election_counts, election_counts_for, fold_election_counts
+from icelect.results import beat_weights
 
 
 static_dir = os.path.abspath('static')
@@ -34,9 +47,237 @@ jenv.globals.update(ElectionState=db.ElectionState)
 
 db.flask_db = SQLAlchemy(app,
                          metadata=db.Base.metadata,
-                         engine_options={
-                             'isolation_level': 'SERIALIZABLE',
-                         })
+                         engine_options=db.engine_options())
+
+
+# Per-worker cache of H2 hashes of valid credentials: election_id -> (serial, hashes).
+# The serial of the election is incremented whenever credentials are registered.
+cred_hash_cache: dict[db.ElectionId, tuple[int, frozenset[str]]] = {}
+
+# Per-worker cache of parsed configuration: election_id -> ((serial, state), ElectionData).
+# The serial is incremented whenever the configuration or the state changes.
+edata_cache: dict[db.ElectionId, tuple[tuple[int, db.ElectionState], ElectionData]] = {}
+
+
+# Per-worker cache of responses of pages of closed elections, whose contents
+# never change unless the serial of the election is incremented.
+class ResponseCache:
+    """
+    LRU cache of bodies of responses: key -> (body, mimetype, content encoding, ETag).
+    """
+
+    max_entries: int
+    max_body: int       # larger (e.g., streamed) responses are not cached
+    entries: OrderedDict[tuple, tuple[bytes, str, str | None, str]]
+
+    def __init__(self, max_entries: int, max_body: int):
+        self.max_entries = max_entries
+        self.max_body = max_body
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple[bytes, str, str | None, str] | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, entry: tuple[bytes, str, str | None, str]) -> None:
+        if len(entry[0]) > self.max_body:
+            return
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+response_cache = ResponseCache(
+    max_entries=getattr(config, 'RESPONSE_CACHE_ENTRIES', 256),
+    max_body=getattr(config, 'RESPONSE_CACHE_MAX_BODY', 1 << 20),
+)
+
+
+def code_stamp() -> str:
+    """
+    Stamp of the deployed code and templates, which changes whenever they do.
+    It is the same in all workers, so they agree on ETags of streamed responses.
+    """
+
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    for dir, _, files in sorted(os.walk(pkg_dir)):
+        for name in sorted(files):
+            if name.endswith(('.py', '.html')):
+                st = os.stat(os.path.join(dir, name))
+                h.update(f'{os.path.relpath(os.path.join(dir, name), pkg_dir)}:{st.st_size}:{st.st_mtime_ns}\n'.encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+# Streamed responses cannot be hashed before sending, so their ETags are derived
+# from the request and this stamp instead of the body
+CODE_STAMP = code_stamp()
+
+
+# Recording of a vote is retried on serialization failures and deadlocks
+# (SQLSTATE 40001 and 40P01) at most VOTE_RETRIES times. Before the k-th retry,
+# we sleep for a random time up to min(VOTE_RETRY_DELAY * 2^k, VOTE_RETRY_MAX_DELAY) seconds.
+VOTE_RETRIES = getattr(config, 'VOTE_RETRIES', 20)
+VOTE_RETRY_DELAY = getattr(config, 'VOTE_RETRY_DELAY', 0.005)
+VOTE_RETRY_MAX_DELAY = getattr(config, 'VOTE_RETRY_MAX_DELAY', 0.1)
+RETRYABLE_SQLSTATES = ('40001', '40P01')
+
+# Per-worker counters: votes recorded, votes rejected since voting was closed,
+# retries, and votes given up after all retries. They are updated by request
+# threads and by the group commit thread, so always under vote_stats_lock.
+vote_stats: Counter[str] = Counter()
+vote_stats_lock = threading.Lock()
+
+
+def count_votes(name: str, n: int = 1) -> None:
+    with vote_stats_lock:
+        vote_stats[name] += n
+
+# A ballot to be recorded: (receipt, nonce, verifier, ranks)
+PendingBallot = tuple[str, str, str, list[int]]
+
+
+class VotingClosedError(Exception):
+    pass
+
+
+def store_ballots(batches: list[tuple[db.ElectionId, ElectionData, list[PendingBallot]]]) -> list[bool] | None:
+    """
+    Record ballots of one or more elections in a single transaction,
+    retrying it on serialization failures. Returns for each batch whether
+    it was recorded (False if voting in its election was already closed),
+    or None if all retries failed.
+    """
+
+    sess = db.get_session()
+    attempt = 0
+    while True:
+        try:
+            accepted = [edata.record_ballots(election_id, ballots) for election_id, edata, ballots in batches]
+            sess.commit()
+            for acc, (_, _, ballots) in zip(accepted, batches):
+                count_votes('recorded' if acc else 'rejected', len(ballots))
+            return accepted
+        except OperationalError as err:
+            sess.rollback()
+            if getattr(err.orig, 'pgcode', None) not in RETRYABLE_SQLSTATES:
+                raise
+            if attempt >= VOTE_RETRIES:
+                count_votes('failed', sum(len(ballots) for _, _, ballots in batches))
+                app.logger.warning(f'Giving up recording ballots after {attempt} retries')
+                return None
+            count_votes('retries')
+            time.sleep(random.uniform(0, min(VOTE_RETRY_DELAY * 2**attempt, VOTE_RETRY_MAX_DELAY)))
+            attempt += 1
+        except Exception:
+            # Do not leave the session in an aborted transaction: the session
+            # of the group commit thread is used for all subsequent batches.
+            sess.rollback()
+            raise
+
+
+class GroupCommitter:
+    """
+    Group commit of votes: ballots submitted by concurrent request threads
+    of a worker are collected for up to `delay` seconds (or until there are
+    `max_batch` of them) by a background thread, which records them in
+    a single transaction. Each request waits until the transaction is committed.
+    The future of a ballot resolves to False if all retries failed and
+    raises VotingClosedError if voting in its election was closed meanwhile.
+    """
+
+    delay: float
+    max_batch: int
+    queue: queue.Queue[tuple[db.ElectionId, ElectionData, PendingBallot, Future[bool]]]
+    thread: threading.Thread | None
+
+    def __init__(self, delay: float, max_batch: int):
+        self.delay = delay
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, election_id: db.ElectionId, edata: ElectionData, ballot: PendingBallot) -> Future[bool]:
+        # The thread is started lazily, so that it runs in the forked worker
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+                self.thread.start()
+
+        future: Future[bool] = Future()
+        self.queue.put((election_id, edata, ballot, future))
+        return future
+
+    def run(self) -> None:
+        with app.app_context():
+            while True:
+                batch = [self.queue.get()]
+                deadline = time.monotonic() + self.delay
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                self.commit(batch)
+
+    def commit(self, batch: list[tuple[db.ElectionId, ElectionData, PendingBallot, Future[bool]]]) -> None:
+        # Group ballots by elections. As in sequential recording,
+        # a later ballot with the same receipt overwrites an earlier one.
+        elections: dict[db.ElectionId, tuple[ElectionData, dict[str, PendingBallot]]] = {}
+        for election_id, edata, ballot, _ in batch:
+            elections.setdefault(election_id, (edata, {}))[1][ballot[0]] = ballot
+
+        try:
+            accepted = store_ballots([
+                (election_id, edata, list(ballots.values()))
+                for election_id, (edata, ballots) in elections.items()
+            ])
+        except Exception as err:
+            app.logger.exception('Group commit failed')
+            for _, _, _, future in batch:
+                future.set_exception(err)
+            return
+
+        count_votes('group_commits')
+        if accepted is None:
+            for _, _, _, future in batch:
+                future.set_result(False)
+            return
+
+        # Ballots of elections where voting was closed before the commit were not recorded
+        closed = {election_id for election_id, acc in zip(elections.keys(), accepted) if not acc}
+        for election_id, _, _, future in batch:
+            if election_id in closed:
+                future.set_exception(VotingClosedError())
+            else:
+                future.set_result(True)
+
+
+group_committer: GroupCommitter | None = None
+if getattr(config, 'VOTE_GROUP_COMMIT', False):
+    group_committer = GroupCommitter(
+        delay=getattr(config, 'VOTE_GROUP_COMMIT_DELAY', 0.005),
+        max_batch=getattr(config, 'VOTE_GROUP_COMMIT_MAX_BATCH', 100),
+    )
+
+
+def election_data(election: db.Election) -> ElectionData:
+    stamp = (election.serial, election.state)
+    cached = edata_cache.get(election.election_id)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    # If the config column was deferred, it is loaded only here
+    edata = ElectionData.from_db(election)
+    edata_cache[election.election_id] = (stamp, edata)
+    return edata
 
 
 def init_request() -> None:
@@ -54,7 +295,7 @@ class IcelectView(View):
 
     def init_election(self, ident: str, admin_only: bool = False) -> None:
         sess = db.get_session()
-        election = sess.scalar(select(db.Election).filter_by(ident=ident))
+        election = sess.scalar(select(db.Election).filter_by(ident=ident).options(defer(db.Election.config)))
         if election is None:
             raise werkzeug.exceptions.NotFound("Election not found")
         self.election = election
@@ -65,28 +306,90 @@ class IcelectView(View):
         if admin_only and not g.is_admin:
             raise werkzeug.exceptions.Forbidden("Available only to administrators")
 
-        self.edata = ElectionData.from_db(election)
+        self.edata = election_data(election)
 
     def is_valid_credential(self, cred: str | None) -> bool:
         if cred is None:
             return False
+        return cred_to_h2(cred) in self.cred_hashes()
+
+    def cred_hashes(self) -> frozenset[str]:
+        election = self.election
+        cached = cred_hash_cache.get(election.election_id)
+        if cached is not None and cached[0] == election.serial:
+            return cached[1]
+
         sess = db.get_session()
-        h2 = cred_to_h2(cred)
-        return sess.scalar(select(db.CredHash).filter_by(election=self.election, hash=h2)) is not None
+        hashes = frozenset(sess.scalars(select(db.CredHash.hash).filter_by(election=election)))
+        cred_hash_cache[election.election_id] = (election.serial, hashes)
+        return hashes
 
     def election_url(self) -> str:
         return url_for('election', ident=self.election.ident)
 
+    def cached_response(self, render: Callable[[], Response | str]) -> Response:
+        """
+        Once voting is closed, pages depend only on the election, its serial and
+        state, the request and the role of the user. Such responses get a strong
+        ETag, so the client can revalidate them, and small responses are kept
+        in response_cache. The ETag is a hash of the body, or for streamed
+        responses, of the request and the version of the code.
+        """
+
+        election = self.election
+        if election.state not in (db.ElectionState.counting, db.ElectionState.results) or session.get('_flashes'):
+            return make_response(render())
+
+        key = (
+            election.election_id, election.serial, election.state,
+            request.endpoint, tuple(sorted(request.args.items(multi=True))),
+            g.role, request.accept_encodings['gzip'] > 0,
+        )
+        stream_etag = hashlib.sha256(repr((CODE_STAMP, key)).encode('utf-8')).hexdigest()[:32]
+
+        if stream_etag in request.if_none_match:
+            resp = Response(status=304)
+            etag = stream_etag
+        elif (entry := response_cache.get(key)) is not None:
+            body, mimetype, encoding, etag = entry
+            if etag in request.if_none_match:
+                resp = Response(status=304)
+            else:
+                resp = Response(body, mimetype=mimetype)
+                resp.content_encoding = encoding
+        else:
+            resp = make_response(render())
+            if resp.status_code != 200:
+                return resp
+            if resp.is_streamed:
+                etag = stream_etag
+            else:
+                body = resp.get_data()
+                etag = hashlib.sha256(body).hexdigest()[:32]
+                response_cache.put(key, (body, resp.mimetype, resp.content_encoding, etag))
+                if etag in request.if_none_match:
+                    resp = Response(status=304)
+
+        resp.set_etag(etag)
+        resp.vary.update(['Accept-Encoding', 'Cookie'])
+        resp.cache_control.no_cache = True      # always revalidate
+        return resp
+
 
 class MainPage(IcelectView):
     def dispatch_request(self) -> str:
         sess = db.get_session()
-        elections = sess.scalars(select(db.Election).order_by(db.Election.order, db.Election.ident))
+        elections = list(sess.scalars(
+            select(db.Election)
+            .options(defer(db.Election.config))
+            .order_by(db.Election.order, db.Election.ident)
+        ))
 
         if not g.is_admin:
             elections = [e for e in elections if e.state != db.ElectionState.init]
 
-        e_data_list = [(e, ElectionData.from_db(e)) for e in elections]
+        counts = election_counts_for([e.election_id for e in elections])
+        e_data_list = [(e, election_data(e), counts.get(e.election_id, ElectionCounts())) for e in elections]
 
         return render_template('index.html', e_data_list=e_data_list)
 
@@ -124,6 +427,7 @@ class ElectionPage(IcelectView):
         return render_template(
             'election.html',
             election=self.election, edata=self.edata,
+            counts=election_counts(self.election.election_id),
             cred_form=cred_form,
             check_form=check_form,
             set_state_form=set_state_form,
@@ -141,6 +445,22 @@ class VoteFormBase(FlaskForm):
             raise wtforms.ValidationError('The nonce may contain only printable non-blank ASCII characters')
 
 
+@cache
+def vote_form_class(num_options: int) -> type[VoteFormBase]:
+    """
+    Form classes depend only on the number of options, so they are created once per worker.
+    """
+
+    class VoteForm(VoteFormBase):
+        pass
+
+    choices = [(str(i), str(i)) for i in range(1, num_options + 1)]
+    for i in range(num_options):
+        setattr(VoteForm, f'rank_{i}', wtforms.RadioField(choices=choices, coerce=int))
+
+    return VoteForm
+
+
 class VotePage(IcelectView):
     methods = ['POST']
 
@@ -151,15 +471,8 @@ class VotePage(IcelectView):
             flash('Voting in this election is no longer allowed.', 'danger')
             return redirect(self.election_url())
 
-        class VoteForm(VoteFormBase):
-            pass
-
-        choices = [(str(i), str(i)) for i in range(1, self.edata.num_options + 1)]
-        for i in range(self.edata.num_options):
-            setattr(VoteForm, f'rank_{i}', wtforms.RadioField(choices=choices, coerce=int))
-
         cred_form = CredentialForm()
-        vote_form = VoteForm()
+        vote_form = vote_form_class(self.edata.num_options)()
 
         if cred_form.validate_on_submit() and cred_form.vote.data:
             cred = cred_form.credential.data
@@ -182,10 +495,16 @@ class VotePage(IcelectView):
                 ranks.append(val)
 
             nonce = vote_form.nonce.data or ""
-            receipt = self.record_vote(cred, nonce, ranks)
+            try:
+                receipt = self.record_vote(cred, nonce, ranks)
+            except VotingClosedError:
+                flash('Voting in this election is no longer allowed. Your vote was not recorded.', 'danger')
+                return redirect(self.election_url())
 
-            flash(f'Your vote has been recorded. Please keep your receipt {receipt} and nonce {nonce}, which can be used to verify your vote later.', 'success')
-            return redirect(self.election_url())
+            if receipt is not None:
+                flash(f'Your vote has been recorded. Please keep your receipt {receipt} and nonce {nonce}, which can be used to verify your vote later.', 'success')
+                return redirect(self.election_url())
+            flash('The server is too busy to record your vote. Please try to send it again.', 'danger')
 
         return render_template(
             'vote.html',
@@ -194,34 +513,30 @@ class VotePage(IcelectView):
             vote_rows=[(self.edata.options[i], getattr(vote_form, f'rank_{i}')) for i in range(self.edata.num_options)],
         )
 
-    def record_vote(self, cred: str, nonce: str, ranks: list[int]) -> str:
+    def record_vote(self, cred: str, nonce: str, ranks: list[int]) -> str | None:
+        """
+        Record a vote and return its receipt, or None if the database
+        kept failing to serialize the transaction. Raises VotingClosedError
+        if voting was closed in the meantime.
+        """
+
         h1 = cred_to_h1(cred)
         receipt = h1_to_receipt(h1, self.election.election_key)
         verifier = h1_to_verifier(h1, self.election.verify_key)
 
-        sess = db.get_session()
-        vins = (insert(db.Verifier)
-                .values(election_id=self.election.election_id, verifier=verifier)
-                .on_conflict_do_nothing())
-        sess.execute(vins)
-
-        bins = (insert(db.Ballot)
-                .values(
-                    election_id=self.election.election_id,
-                    receipt=receipt,
-                    nonce=nonce,
-                    ranks=ranks,
-                )
-                .on_conflict_do_update(
-                    constraint='ballots_election_id_receipt_key',
-                    set_={
-                        'nonce': nonce,
-                        'ranks': ranks,
-                    },
-                ))
-        sess.execute(bins)
-
-        sess.commit()
+        ballot = (receipt, nonce, verifier, ranks)
+        if group_committer is not None:
+            # Return our connection to the pool while waiting for the group commit.
+            # Closing the session detaches the election without expiring it.
+            db.get_session().close()
+            ok = group_committer.submit(self.election.election_id, self.edata, ballot).result()
+        else:
+            accepted = store_ballots([(self.election.election_id, self.edata, [ballot])])
+            if accepted is not None and not accepted[0]:
+                raise VotingClosedError()
+            ok = accepted is not None
+        if not ok:
+            return None
 
         app.logger.info(f'Ballot: election={self.election.ident} receipt={receipt} verifier={verifier} ranks={ranks}')
         return receipt
@@ -262,13 +577,68 @@ class SetElectionState(IcelectView):
         form = SetStateForm()
         if form.validate_on_submit():
             app.logger.info('Setting state of election {ident} to {form.new_state.data}')
+            old_state = self.election.state
             self.election.state = form.new_state.data
-            db.get_session().commit()
+            self.election.serial += 1     # invalidate data cached by web workers
+            sess = db.get_session()
+            sess.commit()
+            if old_state == db.ElectionState.voting and self.election.state != db.ElectionState.voting:
+                # No more votes will append deltas of the counts, so fold them to a single row.
+                # This is a separate transaction, so that it does not conflict with votes.
+                fold_election_counts(self.election.election_id)
+                sess.commit()
             flash(f'State set to {self.election.state.friendly_name()}.', 'success')
 
         return redirect(self.election_url())
 
 
+# Downloads are streamed in chunks of approximately this many bytes,
+# fetching this many rows from the database at once.
+STREAM_CHUNK_BYTES = 1 << 16
+STREAM_YIELD_PER = 1000
+
+
+def stream_response(lines: Iterable[str], mimetype: str) -> Response:
+    """
+    Stream lines as a response, compressed by gzip if the client accepts it.
+    The generator runs within the request context, so it can fetch data
+    from the database while streaming.
+    """
+
+    use_gzip = request.accept_encodings['gzip'] > 0
+
+    def generate() -> Iterator[bytes]:
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None    # wbits=31 selects the gzip format
+        buf: list[str] = []
+        buf_len = 0
+
+        def flush() -> bytes:
+            nonlocal buf, buf_len
+            data = ''.join(buf).encode('utf-8')
+            buf = []
+            buf_len = 0
+            return compressor.compress(data) if compressor else data
+
+        for line in lines:
+            buf.append(line)
+            buf_len += len(line)
+            if buf_len >= STREAM_CHUNK_BYTES:
+                yield flush()
+        yield flush()
+        if compressor:
+            yield compressor.flush()
+
+    resp = Response(stream_with_context(generate()), mimetype=mimetype)
+    resp.vary.add('Accept-Encoding')
+    if use_gzip:
+        resp.content_encoding = 'gzip'
+    return resp
+
+
+# Number of ballots shown on a single page of the list of ballots
+BALLOTS_PER_PAGE = 100
+
+
 class BallotsPage(IcelectView):
     def dispatch_request(self, ident: str):
         self.init_election(ident)
@@ -277,30 +647,83 @@ class BallotsPage(IcelectView):
             flash('Election results are not available yet.', 'danger')
             return redirect(self.election_url())
 
+        if request.endpoint == 'ballots_csv':
+            return self.cached_response(self.ballots_csv)
+        else:
+            return self.cached_response(self.ballots_page)
+
+    def ballots_csv(self) -> Response:
         sess = db.get_session()
-        ballots = sess.scalars(
-            select(db.Ballot)
-            .filter_by(election=self.election)
+        query = (
+            select(db.Ballot.receipt, db.Ballot.nonce, db.Ballot.ranks)
+            .filter_by(election_id=self.election.election_id)
             .order_by(db.Ballot.receipt)
+            .execution_options(yield_per=STREAM_YIELD_PER)
         )
+        header = ['receipt', 'nonce'] + self.edata.options
 
-        if request.endpoint == 'ballots_csv':
+        def csv_lines() -> Iterator[str]:
+            rows = sess.execute(query)
             file = StringIO()
             csw = csv.writer(file)
-            csw.writerow(['receipt', 'nonce'] + self.edata.options)
-            for ballot in ballots:
-                csw.writerow([ballot.receipt, ballot.nonce] + ballot.ranks)
-
-            return Response(
-                response=file.getvalue(),
-                mimetype='text/csv; charset=utf-8',
-            )
+            csw.writerow(header)
+            for part in rows.partitions():
+                for receipt, nonce, ranks in part:
+                    csw.writerow([receipt, nonce] + ranks)
+                yield file.getvalue()
+                file.seek(0)
+                file.truncate()
+            yield file.getvalue()
+
+        return stream_response(csv_lines(), 'text/csv; charset=utf-8')
+
+    def ballots_page(self) -> str:
+        """
+        Ballots are paginated by their receipts: a page contains ballots
+        with receipts after a given one (parameter `after`), before a given
+        one (`before`), or starting with a given prefix or later (`start`).
+        """
+
+        sess = db.get_session()
+        after = request.args.get('after')
+        before = request.args.get('before')
+        start = request.args.get('start', '').strip()
+
+        query = select(db.Ballot).filter_by(election=self.election).limit(BALLOTS_PER_PAGE + 1)
+        if before is not None:
+            ballots = list(sess.scalars(query.filter(db.Ballot.receipt < before).order_by(db.Ballot.receipt.desc())))
+            has_prev = len(ballots) > BALLOTS_PER_PAGE
+            ballots = ballots[:BALLOTS_PER_PAGE][::-1]
+            # The page ends with the last receipt before `before`, so there is a next page
+            # iff some receipt is at least `before` (it need not be an existing receipt)
+            has_next = sess.scalar(select(exists().where(
+                db.Ballot.election_id == self.election.election_id,
+                db.Ballot.receipt >= before,
+            )))
         else:
-            return render_template(
-                'ballots.html',
-                election=self.election, edata=self.edata,
-                ballots=list(ballots),
-            )
+            if after is not None:
+                query = query.filter(db.Ballot.receipt > after)
+            elif start:
+                query = query.filter(db.Ballot.receipt >= start)
+            ballots = list(sess.scalars(query.order_by(db.Ballot.receipt)))
+            has_next = len(ballots) > BALLOTS_PER_PAGE
+            ballots = ballots[:BALLOTS_PER_PAGE]
+            has_prev = False
+            if (after is not None or start) and ballots:
+                has_prev = sess.scalar(select(exists().where(
+                    db.Ballot.election_id == self.election.election_id,
+                    db.Ballot.receipt < ballots[0].receipt,
+                )))
+
+        return render_template(
+            'ballots.html',
+            election=self.election, edata=self.edata,
+            ballots=ballots,
+            num_ballots=election_counts(self.election.election_id).num_ballots,
+            start=start,
+            prev_url=url_for('ballots', ident=self.election.ident, before=ballots[0].receipt) if has_prev and ballots else None,
+            next_url=url_for('ballots', ident=self.election.ident, after=ballots[-1].receipt) if has_next and ballots else None,
+        )
 
 
 class ResultsPage(IcelectView):
@@ -311,27 +734,32 @@ class ResultsPage(IcelectView):
             flash('Election results are not available yet.', 'danger')
             return redirect(self.election_url())
 
+        return self.cached_response(self.results_page)
+
+    def results_page(self) -> str:
         sess = db.get_session()
         result = sess.get(db.Result, self.election.election_id)
         if result is None:
             raise werkzeug.exceptions.NotFound("Election results not found")
         json = result.result
 
-        num_votes = sess.scalar(select(func.count()).select_from(db.Ballot).filter_by(election=self.election))
-        num_voters = sess.scalar(select(func.count()).select_from(db.CredHash).filter_by(election=self.election))
         schulze_order = json['schulze_order']
 
+        # Older results contain weights, newer ones only beats
+        weights = json.get('weights')
+        if weights is None:
+            weights = beat_weights(np.array(json['beats'])).tolist()
+
         return render_template(
             'results.html',
             election=self.election, edata=self.edata,
-            num_votes=num_votes,
-            num_voters=num_voters,
+            counts=election_counts(self.election.election_id),
             condorcet_winner=self.edata.options[json['condorcet_winner']] if json['condorcet_winner'] is not None else None,    # type: ignore
             weak_condorcet_winners=[self.edata.options[w] for w in json['weak_condorcet_winners']],
             schulze_winners=[self.edata.options[w] for w in schulze_order[0]],
             schulze_layers=[[self.edata.options[w] for w in layer] for layer in schulze_order],
             beats=json['beats'],
-            weights=json['weights'],
+            weights=weights,
             strengths=json['strengths'],
         )
 
@@ -344,22 +772,28 @@ class VerifierDownload(IcelectView):
         if self.election.state not in (db.ElectionState.counting, db.ElectionState.results) or not (g.is_admin or g.is_reg):
             raise werkzeug.exceptions.Forbidden("Not available to you")
 
+        return self.cached_response(self.verifiers)
+
+    def verifiers(self) -> Response:
         sess = db.get_session()
-        verifiers = list(sess.scalars(
+        query = (
             select(db.Verifier.verifier)
-            .filter_by(election=self.election)
+            .filter_by(election_id=self.election.election_id)
             .order_by(db.Verifier.verifier)
-        ))
-
-        out = [
-            f'# Election: {ident}',
+            .execution_options(yield_per=STREAM_YIELD_PER)
+        )
+        header = [
+            f'# Election: {self.election.ident}',
             f'# Verification key: {self.election.verify_key}',
-        ] + verifiers + []
+        ]
 
-        return Response(
-            response="\n".join(out),
-            mimetype='text/plain; charset=utf-8',
-        )
+        def lines() -> Iterator[str]:
+            for line in header:
+                yield line + '\n'
+            for verifier in sess.scalars(query):
+                yield verifier + '\n'
+
+        return stream_response(lines(), 'text/plain; charset=utf-8')
 
 
 class LoginForm(FlaskForm):
@@ -398,9 +832,30 @@ class LogoutPage(IcelectView):
         return redirect(url_for('index'))
 
 
+class StatusPage(IcelectView):
+    """
+    Statistics of this worker for monitoring, available to administrators.
+    """
+
+    def dispatch_request(self):
+        if not g.is_admin:
+            raise werkzeug.exceptions.Forbidden("Available only to administrators")
+
+        with vote_stats_lock:
+            votes = dict(vote_stats)
+
+        return {
+            'pid': os.getpid(),
+            'pool': db.pool_stats(db.flask_db.engine),
+            'votes': votes,
+            'response_cache_entries': len(response_cache.entries),
+        }
+
+
 app.add_url_rule('/', view_func=MainPage.as_view('index'))
 app.add_url_rule('/login', view_func=LoginPage.as_view('login'))
 app.add_url_rule('/logout', view_func=LogoutPage.as_view('logout'))
+app.add_url_rule('/admin/status', view_func=StatusPage.as_view('status'))
 app.add_url_rule('/e/<ident>/', view_func=ElectionPage.as_view('election'))
 app.add_url_rule('/e/<ident>/vote', view_func=VotePage.as_view('vote'))
 app.add_url_rule('/e/<ident>/check', view_func=CheckVotePage.as_view('check_vote'))
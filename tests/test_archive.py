@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Icelect - Test cases for binary ballot archives
+# (c) 2025 Martin Mareš <mj@ucw.cz>
+
+import numpy as np
+import os
+import tempfile
+import unittest
+
+from icelect.archive import ArchiveError, BallotArchive, BallotArchiveWriter, is_ballot_archive
+
+
+class ArchiveTests(unittest.TestCase):
+    """Writing and reading of binary ballot archives."""
+
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self) -> None:
+        os.unlink(self.path)
+
+    def test_round_trip(self) -> None:
+        rng = np.random.default_rng(42)
+        ranks = rng.integers(1, 6, size=(1000, 5))
+        receipts = [f'r{i}' for i in range(1000)]
+        nonces = [f'n{i}' for i in range(1000)]
+
+        with BallotArchiveWriter(self.path, list('ABCDE')) as writer:
+            writer.add(receipts[:300], nonces[:300], ranks[:300])
+            writer.add(receipts[300:], nonces[300:], ranks[300:])
+
+        self.assertTrue(is_ballot_archive(self.path))
+        archive = BallotArchive(self.path)
+        self.assertEqual(archive.options, list('ABCDE'))
+        self.assertEqual(archive.num_ballots, 1000)
+        self.assertTrue(np.array_equal(archive.ranks, ranks))
+        self.assertEqual(list(archive.receipts()), list(zip(receipts, nonces)))
+
+    def test_empty(self) -> None:
+        with BallotArchiveWriter(self.path, list('ABC')):
+            pass
+
+        archive = BallotArchive(self.path)
+        self.assertEqual(archive.ranks.shape, (0, 3))
+        self.assertEqual(list(archive.receipts()), [])
+
+    def test_invalid(self) -> None:
+        with open(self.path, 'w') as f:
+            f.write('receipt,nonce,A,B\n')
+
+        self.assertFalse(is_ballot_archive(self.path))
+        with self.assertRaises(ArchiveError):
+            BallotArchive(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Icelect - Test cases for reading ballots from CSV files
+# (c) 2025 Martin Mareš <mj@ucw.cz>
+
+import csv
+import io
+import numpy as np
+import os
+import tempfile
+import unittest
+
+from icelect.election import BallotFileError, CsvBallotReader, ElectionData
+from icelect.results import beat_matrix
+
+
+CSV_DIR = os.path.join(os.path.dirname(__file__), 'csv')
+CSV_FILES = sorted(os.path.join(CSV_DIR, name) for name in os.listdir(CSV_DIR) if name.endswith('.csv'))
+
+
+class CsvBallotTests(unittest.TestCase):
+    """Streaming of ballots from CSV files."""
+
+    def parsed_beats(self, filename: str) -> np.ndarray:
+        with open(filename) as f:
+            rows = list(csv.reader(f))
+        num_options = len(rows[0]) - 2
+        return beat_matrix(num_options, [[int(r) for r in row[2:]] for row in rows[1:]])
+
+    def check_file(self, filename: str, **kwargs) -> None:
+        with self.subTest(filename=os.path.basename(filename), **kwargs):
+            expected = self.parsed_beats(filename)
+            ed = ElectionData.from_csv_ballots(filename, **kwargs)
+            self.assertEqual(ed.num_options, expected.shape[0])
+            self.assertTrue(np.array_equal(ed.beats, expected))
+
+    def test_electowiki(self) -> None:
+        self.assertTrue(CSV_FILES)
+        for filename in CSV_FILES:
+            self.check_file(filename)
+
+    def test_chunks(self) -> None:
+        for filename in CSV_FILES:
+            self.check_file(filename, chunk_rows=7)
+            self.check_file(filename, chunk_rows=1)
+
+    def test_workers(self) -> None:
+        for filename in CSV_FILES:
+            self.check_file(filename, workers=2, chunk_rows=5)
+
+    def test_chunk_contents(self) -> None:
+        reader = CsvBallotReader(io.StringIO('receipt,nonce,A,B\nr1,n1,1,2\nr2,n2,2,1\nr3,n3,1,1\n'), 'test.csv')
+        self.assertEqual(reader.options, ['A', 'B'])
+        chunks = list(reader.chunks(2))
+        self.assertEqual([c[0] for c in chunks], [['r1', 'r2'], ['r3']])
+        self.assertEqual([c[1] for c in chunks], [['n1', 'n2'], ['n3']])
+        self.assertEqual(chunks[0][2].dtype, np.int16)
+        self.assertEqual(np.concatenate([c[2] for c in chunks]).tolist(), [[1, 2], [2, 1], [1, 1]])
+        self.assertEqual(reader.num_ballots, 3)
+
+    def check_error(self, contents: str) -> None:
+        with self.assertRaises(BallotFileError):
+            reader = CsvBallotReader(io.StringIO(contents), 'test.csv')
+            for _ in reader.chunks():
+                pass
+
+    def test_errors(self) -> None:
+        self.check_error('')
+        self.check_error('receipt,nonce,A\n')
+        self.check_error('id,nonce,A,B\n')
+        self.check_error('receipt,nonce,A,B\nr1,n1,1\n')
+        self.check_error('receipt,nonce,A,B\nr1,n1,1,2,3\n')
+        self.check_error('receipt,nonce,A,B\nr1,n1,1,x\n')
+        self.check_error('receipt,nonce,A,B\nr1,n1,1,40000\n')
+
+    def test_file_errors(self) -> None:
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('receipt,nonce,A,B\nr1,n1,1,2\nr2,n2,1,-40000\n')
+            with self.assertRaises(BallotFileError):
+                ElectionData.from_csv_ballots(path)
+            with self.assertRaises(BallotFileError):
+                ElectionData.from_csv_ballots(path, workers=2, chunk_rows=1)
+        finally:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
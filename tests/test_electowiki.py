@@ -15,6 +15,7 @@ class SchulzeTests(unittest.TestCase):
         options = [chr(ord('A') + i) for i in range(n)]
 
         ranks = []
+        counts = []
         for count, perm in votes:
             assert len(perm) == n
             rank = [0] * n
@@ -22,14 +23,25 @@ class SchulzeTests(unittest.TestCase):
                 j = ord(perm[i]) - ord('A')
                 assert j >= 0 and j < n
                 rank[j] = i + 1
-            ranks += [rank] * count
+            ranks.append(rank)
+            counts.append(count)
 
-        res = Results(n, ranks)
+        res = Results(n, ranks, counts)
         # res.debug()
 
         order = [set(options[w] for w in layer) for layer in res.schulze_order]
         self.assertEqual(order, [set(layer) for layer in expected_order])
 
+        expanded = [rank for rank, count in zip(ranks, counts) for _ in range(count)]
+        res_expanded = Results(n, expanded)
+        self.assertEqual(res_expanded.beats.tolist(), res.beats.tolist())
+        self.assertEqual(res_expanded.schulze_order, res.schulze_order)
+
+        for engine in ['loop', 'vectorized', 'incremental']:
+            res_engine = Results(n, ranks, counts, strength_engine=engine)
+            self.assertEqual(res_engine.strengths.tolist(), res.strengths.tolist())
+            self.assertEqual(res_engine.schulze_order, res.schulze_order)
+
 
     def test_1(self) -> None:
         self.schulze_winners([
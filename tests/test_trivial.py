@@ -3,9 +3,12 @@
 # (c) 2025 Martin Mareš <mj@ucw.cz>
 
 from itertools import permutations, product
+import numpy as np
 import unittest
+from unittest.mock import patch
 
-from icelect.results import Results
+import icelect.results
+from icelect.results import BatchResults, Results, beat_matrix, collapse_ballots, resample_counts
 
 
 class ResultTests(unittest.TestCase):
@@ -39,6 +42,112 @@ class ResultTests(unittest.TestCase):
         self.assertEqual(res.weak_condorcet_winners, [0])
         self.assertEqual(res.schulze_order, [[0], [2,3,4], [1]])
 
+    def test_beat_matrix(self) -> None:
+        rng = np.random.default_rng(42)
+        ranks = rng.integers(1, 7, size=(500, 6)).tolist()
+        expected = np.zeros((6, 6), dtype=np.int32)
+        for rank in ranks:
+            for i in range(6):
+                for j in range(6):
+                    if rank[i] < rank[j]:
+                        expected[i,j] += 1
+        self.assertTrue(np.array_equal(beat_matrix(6, ranks), expected))
+        self.assertTrue(np.array_equal(beat_matrix(6, []), np.zeros((6, 6))))
+
+    @patch.object(icelect.results, 'BEATS_CHUNK_CELLS', 100)
+    def test_sharded_beat_matrix(self) -> None:
+        rng = np.random.default_rng(42)
+        ranks = rng.integers(1, 6, size=(1000, 5))
+        counts = rng.integers(1, 10, size=1000)
+        self.assertTrue(np.array_equal(beat_matrix(5, ranks, workers=3), beat_matrix(5, ranks)))
+        self.assertTrue(np.array_equal(beat_matrix(5, ranks, counts, workers=3), beat_matrix(5, ranks, counts)))
+
+    def test_strength_engines(self) -> None:
+        rng = np.random.default_rng(42)
+        for n in [2, 3, 5, 8, 13, 30]:
+            for _ in range(10):
+                ranks = rng.integers(1, n + 1, size=(rng.integers(1, 50), n))
+                res = Results(n, ranks, strength_engine='loop')
+                for engine in ['vectorized', 'incremental']:
+                    res_engine = Results(n, ranks, strength_engine=engine)
+                    self.assertTrue(np.array_equal(res.strengths, res_engine.strengths))
+                    self.assertEqual(res.schulze_order, res_engine.schulze_order)
+
+    @patch.object(icelect.results, 'AUTO_INCREMENTAL_OPTIONS', 2)
+    def test_auto_engine(self) -> None:
+        rng = np.random.default_rng(42)
+        for n in [5, 30, 100]:
+            # Random ballots and ballots close to a consensus order (which make the incremental engine give up)
+            for ranks in [rng.integers(1, n + 1, size=(20, n)), np.argsort(rng.random((20, n)) + np.arange(n) / n, axis=1)]:
+                res = Results(n, ranks, strength_engine='vectorized')
+                res_auto = Results(n, ranks, strength_engine='auto')
+                self.assertTrue(np.array_equal(res.strengths, res_auto.strengths))
+                self.assertEqual(res.schulze_order, res_auto.schulze_order)
+
+    def test_compact(self) -> None:
+        ranks = list(map(list, permutations(range(5))))
+        res = Results(5, ranks)
+        self.assertIsNone(res.ballots)
+        self.assertEqual(res.beats.dtype, np.int8)
+        self.assertEqual(res.strengths.dtype, np.int8)
+        self.assertTrue(np.array_equal(res.beats, beat_matrix(5, ranks)))
+
+        res = Results(5, ranks, [1000] * len(ranks), keep_ballots=True)
+        self.assertIs(res.ballots, ranks)
+        self.assertEqual(res.beats.dtype, np.int32)
+
+        json = res.to_json()
+        self.assertEqual(json['beats'], res.beats.tolist())
+        self.assertNotIn('weights', json)
+        self.assertEqual(type(json['strengths'][0][0]), int)
+
+    def check_batch(self, batch: BatchResults, results: list[Results]) -> None:
+        self.assertEqual(batch.num_replicates, len(results))
+        for k, res in enumerate(results):
+            self.assertTrue(np.array_equal(batch.beats[k], res.beats))
+            self.assertTrue(np.array_equal(batch.strengths[k], res.strengths))
+            self.assertEqual(batch.condorcet_winners[k], -1 if res.condorcet_winner is None else res.condorcet_winner)
+            self.assertEqual(batch.schulze_order(k), res.schulze_order)
+            self.assertEqual(np.flatnonzero(batch.winners[k]).tolist(), res.schulze_order[0])
+
+    @patch.object(icelect.results, 'BEATS_CHUNK_CELLS', 100)
+    def test_batch(self) -> None:
+        rng = np.random.default_rng(42)
+        for n in [2, 3, 5, 8]:
+            ranks = rng.integers(1, n + 1, size=(20, 30, n))
+            self.check_batch(BatchResults(n, ranks), [Results(n, r) for r in ranks])
+
+            distinct, counts = collapse_ballots(n, ranks[0])
+            for replace in [True, False]:
+                resampled = resample_counts(rng, counts, 20, sample_size=25, replace=replace)
+                self.assertTrue(np.all(resampled.sum(axis=1) == 25))
+                batch = BatchResults(n, distinct, resampled)
+                self.check_batch(batch, [Results(n, distinct, c) for c in resampled])
+                self.assertTrue(np.array_equal(batch.winner_frequency(), batch.winners.mean(axis=0)))
+
+    def test_layers(self) -> None:
+        rng = np.random.default_rng(42)
+        for n in [2, 3, 5, 8, 13, 30]:
+            for _ in range(10):
+                ranks = rng.integers(1, n + 1, size=(rng.integers(1, 50), n))
+                res = Results(n, ranks)
+
+                # Reference: repeatedly remove options not path-beaten by any remaining option
+                expected = []
+                remains = set(range(n))
+                while remains:
+                    layer = {j for j in remains if not any(res.stronger[i,j] for i in remains)}
+                    expected.append(sorted(layer))
+                    remains -= layer
+                self.assertEqual(res.schulze_order, expected)
+
+                self.assertEqual(
+                    res.weak_condorcet_winners,
+                    [i for i in range(n) if all(res.beats[i,j] >= res.beats[j,i] for j in range(n))],
+                )
+                strong = [i for i in range(n) if all(res.beats[i,j] > res.beats[j,i] for j in range(n) if j != i)]
+                self.assertEqual(res.condorcet_winner, strong[0] if strong else None)
+
 
 if __name__ == "__main__":
     unittest.main()